@@ -0,0 +1,1069 @@
+"""Shared implementation of the WisprClaw transcription gateways.
+
+``whisper_gateway.py`` and ``main.py`` build their FastAPI apps with
+:func:`app_factory` and start them with :func:`serve`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+from pathlib import Path
+from typing import Any
+
+from fastapi import FastAPI, File, HTTPException, Request, Response, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+import uvicorn
+
+
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
+# Exact spellings answered without normalizing; anything else takes the slow path.
+_TRUTHY_EXACT = _TRUTHY | {v.upper() for v in _TRUTHY} | {v.title() for v in _TRUTHY}
+_FALSY_EXACT = frozenset({"0", "false", "no", "off", "False", "FALSE", "No", "NO", "Off", "OFF"})
+
+
+# Log records are queued on the request path and formatted/written by a
+# background listener thread, so logging never blocks the event loop on stdout.
+logger = logging.getLogger("wisprclaw.gateway")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(
+    logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%dT%H:%M:%S")
+)
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+
+def _is_truthy(value: str | None, default: bool = False) -> bool:
+    if value is None:
+        return default
+    if value in _TRUTHY_EXACT:
+        return True
+    if value in _FALSY_EXACT:
+        return False
+    return value.strip().lower() in _TRUTHY
+
+
+# One .env assignment per line: optional ``export``, then a double-quoted,
+# single-quoted, or bare value (bare values end at `` #`` comments).
+_DOTENV_LINE = re.compile(
+    r"""^[^\S\n]*(?:export[^\S\n]+)?([A-Za-z_][A-Za-z0-9_]*)[^\S\n]*=[^\S\n]*"""
+    r"""(?:"(.*)"|'(.*)'|(.*?)(?:[^\S\n]+#.*)?)[^\S\n]*$""",
+    re.MULTILINE,
+)
+
+
+def _load_dotenv() -> None:
+    """Load .env values into process env if not already exported.
+
+    Search order:
+    1) current working directory
+    2) gateway directory
+    3) project root (parent of gateway directory)
+    """
+    search_paths = [
+        Path.cwd() / ".env",
+        Path(__file__).resolve().parent / ".env",
+        Path(__file__).resolve().parent.parent / ".env",
+    ]
+    seen: set[Path] = set()
+
+    for env_path in search_paths:
+        resolved = env_path.resolve()
+        if resolved in seen:
+            continue
+        seen.add(resolved)
+
+        if not env_path.exists():
+            continue
+
+        try:
+            text = env_path.read_text(encoding="utf-8")
+        except OSError:
+            continue
+
+        for match in _DOTENV_LINE.finditer(text):
+            key, double_quoted, single_quoted, bare = match.groups()
+            if double_quoted is not None:
+                value = double_quoted
+            elif single_quoted is not None:
+                value = single_quoted
+            else:
+                value = bare
+            os.environ.setdefault(key, value)
+
+        # Stop at the first .env file found in the search order.
+        break
+
+
+_load_dotenv()
+
+MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "openai").strip().lower()
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto").strip().lower()
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "").strip().lower()
+WHISPER_DOWNLOAD_ROOT = os.getenv("WHISPER_DOWNLOAD_ROOT")
+WHISPER_ONNX_MODEL = os.getenv("WHISPER_ONNX_MODEL")
+WHISPER_SSL_CA_FILE = os.getenv("WHISPER_SSL_CA_FILE")
+WHISPER_INSECURE_DOWNLOAD = _is_truthy(os.getenv("WHISPER_INSECURE_DOWNLOAD", "0"))
+LLMLINGUA_SMALL = _is_truthy(os.getenv("LLMLINGUA_SMALL", "0"))
+LLMLINGUA_MODEL = os.getenv(
+    "LLMLINGUA_MODEL",
+    "microsoft/llmlingua-2-bert-base-multilingual-cased-meetingbank"
+    if LLMLINGUA_SMALL
+    else "microsoft/llmlingua-2-xlm-roberta-large-meetingbank",
+)
+LLMLINGUA_QUANTIZE = _is_truthy(os.getenv("LLMLINGUA_QUANTIZE", "1"), default=True)
+LLMLINGUA_ENABLED = _is_truthy(os.getenv("LLMLINGUA_ENABLED", "1"), default=True)
+LLMLINGUA_DEVICE = os.getenv("LLMLINGUA_DEVICE", "auto").strip().lower()
+LLMLINGUA_RATE = float(os.getenv("LLMLINGUA_RATE", "0.6"))
+LLMLINGUA_USE_V2 = _is_truthy(os.getenv("LLMLINGUA_USE_V2", "1"), default=True)
+LLMLINGUA_MIN_CHARS = int(os.getenv("LLMLINGUA_MIN_CHARS", "200"))
+LLMLINGUA_MIN_TOKENS = int(os.getenv("LLMLINGUA_MIN_TOKENS", "0"))
+LLMLINGUA_BATCH_MAX = max(1, int(os.getenv("LLMLINGUA_BATCH_MAX", "8")))
+LLMLINGUA_BATCH_WAIT_MS = float(os.getenv("LLMLINGUA_BATCH_WAIT_MS", "0"))
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_MB", "25")) * 1024 * 1024
+WHISPER_WORKERS = max(1, int(os.getenv("WHISPER_WORKERS", "1")))
+MAX_INFLIGHT = max(1, int(os.getenv("MAX_INFLIGHT", "4")))
+UPLOAD_CHUNK_BYTES = 1 << 20
+# Allowance for multipart boundaries and part headers around the audio bytes.
+MULTIPART_OVERHEAD_BYTES = 4096
+# Whisper models expect 16 kHz mono input.
+SAMPLE_RATE = 16000
+# Little-endian sample formats accepted by /transcribe_raw, with numpy dtypes.
+RAW_SAMPLE_FORMATS = {"f32le": "<f4", "s16le": "<i2"}
+
+_model = None
+_model_lock = threading.Lock()
+_model_device = ""
+_onnx_processor = None
+_compressor = None
+_compressor_lock = threading.Lock()
+# Created at startup, once the model device is known.
+_infer_pool: ThreadPoolExecutor | None = None
+# Bounds requests holding an audio buffer while waiting for the inference pool.
+_inflight = asyncio.Semaphore(MAX_INFLIGHT)
+# Pending (transcript, future) pairs for the LLMLingua batcher; set up at startup.
+_compress_queue: asyncio.Queue[tuple[str, asyncio.Future[str]]] | None = None
+_compress_task: asyncio.Task[None] | None = None
+_tls_configured = False
+_tls_opener: urllib.request.OpenerDirector | None = None
+
+
+def configure_whisper_download_tls() -> None:
+    """Configure urllib TLS trust used by Whisper model downloads.
+
+    The opener is built once per process and reinstalled on later calls.
+    A failed setup is not cached, so later calls raise again.
+    """
+    global _tls_configured, _tls_opener
+    if _tls_configured:
+        if _tls_opener is not None:
+            urllib.request.install_opener(_tls_opener)
+        return
+
+    if WHISPER_INSECURE_DOWNLOAD:
+        insecure_context = ssl._create_unverified_context()
+        _tls_opener = urllib.request.build_opener(
+            urllib.request.HTTPSHandler(context=insecure_context)
+        )
+        urllib.request.install_opener(_tls_opener)
+        _tls_configured = True
+        return
+
+    ca_file = WHISPER_SSL_CA_FILE or os.getenv("SSL_CERT_FILE")
+    if ca_file and not Path(ca_file).expanduser().is_file():
+        ca_file = None
+    if not ca_file:
+        try:
+            import certifi
+
+            ca_file = certifi.where()
+        except Exception:
+            ca_file = None
+
+    if ca_file:
+        os.environ.setdefault("SSL_CERT_FILE", ca_file)
+        context = ssl.create_default_context(cafile=ca_file)
+        _tls_opener = urllib.request.build_opener(
+            urllib.request.HTTPSHandler(context=context)
+        )
+        urllib.request.install_opener(_tls_opener)
+
+    # Only remember success, so a bad CA bundle keeps failing on retries.
+    _tls_configured = True
+
+
+def _torch_whisper_device() -> str:
+    """Resolve ``WHISPER_DEVICE`` for the PyTorch (openai-whisper) backend."""
+    if WHISPER_DEVICE != "auto":
+        return WHISPER_DEVICE
+
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            return "cuda"
+    except Exception:
+        pass
+    # openai-whisper relies on sparse ops that MPS does not implement, so
+    # auto-detection stays on CPU there; WHISPER_DEVICE=mps opts in explicitly.
+    return "cpu"
+
+
+def _faster_whisper_device() -> str:
+    """Resolve ``WHISPER_DEVICE`` for CTranslate2, which supports CUDA and CPU only."""
+    if WHISPER_DEVICE in {"cuda", "cpu"}:
+        return WHISPER_DEVICE
+    if WHISPER_DEVICE != "auto":
+        return "cpu"
+
+    try:
+        import ctranslate2  # type: ignore
+
+        if ctranslate2.get_cuda_device_count() > 0:
+            return "cuda"
+    except Exception:
+        pass
+    return "cpu"
+
+
+def _faster_whisper_compute_type(device: str) -> str:
+    """Pick an INT8 compute type, falling back to FP16 on GPUs without INT8 support."""
+    if WHISPER_COMPUTE_TYPE:
+        return WHISPER_COMPUTE_TYPE
+    if device != "cuda":
+        return "int8"
+
+    try:
+        import ctranslate2  # type: ignore
+
+        supported = ctranslate2.get_supported_compute_types("cuda")
+    except Exception:
+        return "float16"
+
+    # GPUs without Tensor cores (pre-Volta) cannot run int8_float16.
+    return "int8_float16" if "int8_float16" in supported else "float16"
+
+
+def _load_faster_whisper(load_kwargs: dict[str, Any]) -> tuple[Any, str]:
+    try:
+        from faster_whisper import WhisperModel  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError(
+            "faster-whisper is not installed. "
+            "Install with: pip install faster-whisper"
+        ) from exc
+
+    device = _faster_whisper_device()
+    compute_type = _faster_whisper_compute_type(device)
+    model = WhisperModel(
+        MODEL_NAME,
+        device=device,
+        compute_type=compute_type,
+        **load_kwargs,
+    )
+    return model, f"{device} ({compute_type})"
+
+
+def _load_openai_whisper(load_kwargs: dict[str, Any]) -> tuple[Any, str]:
+    try:
+        import whisper  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError(
+            "openai-whisper is not installed. "
+            "Install with: pip install openai-whisper"
+        ) from exc
+
+    model = whisper.load_model(MODEL_NAME, device=_torch_whisper_device(), **load_kwargs)
+    return model, str(model.device)
+
+
+def _load_onnx_whisper(load_kwargs: dict[str, Any]) -> tuple[Any, str]:
+    global _onnx_processor
+    try:
+        import onnxruntime  # type: ignore
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq  # type: ignore
+        from transformers import WhisperProcessor  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError(
+            "ONNX Runtime backend dependencies are not installed. "
+            "Install with: pip install optimum[onnxruntime] transformers"
+        ) from exc
+
+    use_cuda = (
+        _torch_whisper_device() == "cuda"
+        and "CUDAExecutionProvider" in onnxruntime.get_available_providers()
+    )
+    provider = "CUDAExecutionProvider" if use_cuda else "CPUExecutionProvider"
+
+    hf_kwargs: dict[str, Any] = {}
+    if "download_root" in load_kwargs:
+        hf_kwargs["cache_dir"] = load_kwargs["download_root"]
+
+    # Without a pre-exported (e.g. INT8) artifact, export the FP32 HF checkpoint.
+    model_id = WHISPER_ONNX_MODEL or f"openai/whisper-{MODEL_NAME}"
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(
+        model_id,
+        export=not WHISPER_ONNX_MODEL,
+        provider=provider,
+        # IO binding keeps decoder inputs/outputs on the GPU between steps.
+        use_io_binding=use_cuda,
+        **hf_kwargs,
+    )
+    _onnx_processor = WhisperProcessor.from_pretrained(model_id, **hf_kwargs)
+    return model, provider
+
+
+def _transcribe_onnx(model: Any, audio: Any) -> str:
+    processor = _onnx_processor
+    # Only clips longer than Whisper's 30 s window need long-form features;
+    # everything else uses the standard padded input.
+    if len(audio) > 30 * SAMPLE_RATE:
+        inputs = processor(
+            audio,
+            sampling_rate=SAMPLE_RATE,
+            return_tensors="pt",
+            truncation=False,
+            padding="longest",
+            return_attention_mask=True,
+        )
+    else:
+        inputs = processor(audio, sampling_rate=SAMPLE_RATE, return_tensors="pt")
+
+    predicted_ids = model.generate(**inputs.to(model.device))
+    return processor.batch_decode(predicted_ids, skip_special_tokens=True)[0].strip()
+
+
+def get_model() -> Any:
+    """Load Whisper once per process and reuse across requests.
+
+    Loading is serialized with a lock so concurrent callers never load twice.
+    ``WHISPER_BACKEND`` selects the inference engine: ``openai`` (default,
+    reference openai-whisper), ``faster`` (faster-whisper / CTranslate2 with
+    INT8 weights) or ``onnxruntime`` (Optimum ONNX Runtime, typically loading
+    an INT8 export from ``WHISPER_ONNX_MODEL``).
+    """
+    global _model
+    if _model is not None:
+        return _model
+
+    with _model_lock:
+        if _model is None:
+            _model = _load_model()
+    return _model
+
+
+def _load_model() -> Any:
+    global _model_device
+    if WHISPER_BACKEND == "faster":
+        loader = _load_faster_whisper
+    elif WHISPER_BACKEND == "onnxruntime":
+        loader = _load_onnx_whisper
+    elif WHISPER_BACKEND == "openai":
+        loader = _load_openai_whisper
+    else:
+        raise RuntimeError(
+            f"Unsupported WHISPER_BACKEND={WHISPER_BACKEND!r}. "
+            "Use 'openai', 'faster' or 'onnxruntime'."
+        )
+
+    configure_whisper_download_tls()
+
+    load_kwargs: dict[str, Any] = {}
+    if WHISPER_DOWNLOAD_ROOT:
+        load_kwargs["download_root"] = os.path.expanduser(WHISPER_DOWNLOAD_ROOT)
+
+    try:
+        model, device = loader(load_kwargs)
+    except Exception as exc:
+        message = str(exc)
+        if "CERTIFICATE_VERIFY_FAILED" in message or "certificate verify failed" in message:
+            raise RuntimeError(
+                "Whisper model download failed TLS verification. "
+                "Set WHISPER_SSL_CA_FILE to your trusted CA bundle, "
+                "or set WHISPER_INSECURE_DOWNLOAD=1 as a last resort."
+            ) from exc
+        raise
+
+    # Log the resolved device once so a silent CPU fallback is visible.
+    logger.info(
+        "whisper_model: %s backend=%s device=%s", MODEL_NAME, WHISPER_BACKEND, device
+    )
+    _model_device = device
+    return model
+
+
+def _decode_with_ffmpeg(raw_audio: memoryview, suffix: str) -> Any:
+    """Decode via an ffmpeg subprocess, as openai-whisper does internally.
+
+    On Linux the bytes are staged in a memfd so they never touch disk; other
+    platforms fall back to a named temporary file.
+    """
+    import numpy as np
+
+    memfd = -1
+    temp_path = ""
+    try:
+        if hasattr(os, "memfd_create"):
+            memfd = os.memfd_create("wisprclaw-audio")
+            view = raw_audio
+            while view:
+                view = view[os.write(memfd, view):]
+            # ffmpeg inherits the fd, so its own /proc/self/fd entry resolves to it.
+            input_path = f"/proc/self/fd/{memfd}"
+        else:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+                temp_file.write(raw_audio)
+                temp_path = temp_file.name
+            input_path = temp_path
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-threads", "0", "-i", input_path,
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+            "-",
+        ]
+        try:
+            output = subprocess.run(
+                cmd,
+                capture_output=True,
+                check=True,
+                pass_fds=(memfd,) if memfd >= 0 else (),
+            ).stdout
+        except FileNotFoundError as exc:
+            raise RuntimeError(
+                "ffmpeg is required to decode this audio format. "
+                "Install with: brew install ffmpeg"
+            ) from exc
+        except subprocess.CalledProcessError as exc:
+            stderr = exc.stderr.decode(errors="ignore").strip()
+            raise RuntimeError(f"Failed to decode audio: {stderr}") from exc
+    finally:
+        if memfd >= 0:
+            os.close(memfd)
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio(audio: io.BytesIO, suffix: str) -> Any:
+    """Decode an upload to 16 kHz mono float32 PCM in memory.
+
+    Formats libsndfile can read (WAV, FLAC, OGG, ...) are decoded in-process
+    straight from ``audio``; anything else falls back to ffmpeg.
+    """
+    try:
+        import numpy as np
+        import soundfile as sf  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy and soundfile are not installed. "
+            "Install with: pip install numpy soundfile"
+        ) from exc
+
+    try:
+        pcm, sample_rate = sf.read(audio, dtype="float32", always_2d=False)
+    except Exception:
+        # getbuffer() exposes the upload without copying it.
+        with audio.getbuffer() as raw_audio:
+            return _decode_with_ffmpeg(raw_audio, suffix)
+
+    if pcm.ndim == 2:
+        pcm = pcm.mean(axis=1)
+    return _resample(pcm, sample_rate)
+
+
+def decode_raw_pcm(raw_audio: bytes, sample_rate: int, sample_format: str) -> Any:
+    """Interpret raw mono PCM (see ``RAW_SAMPLE_FORMATS``) as 16 kHz float32."""
+    try:
+        import numpy as np
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy is not installed. Install with: pip install numpy"
+        ) from exc
+
+    pcm = np.frombuffer(raw_audio, dtype=RAW_SAMPLE_FORMATS[sample_format])
+    if sample_format == "s16le":
+        pcm = pcm.astype(np.float32) / 32768.0
+    return _resample(pcm, sample_rate)
+
+
+def _resample(pcm: Any, sample_rate: int) -> Any:
+    import numpy as np
+
+    if sample_rate != SAMPLE_RATE:
+        import soxr  # type: ignore
+
+        pcm = soxr.resample(pcm, sample_rate, SAMPLE_RATE, quality="HQ")
+    return np.ascontiguousarray(pcm, dtype=np.float32)
+
+
+def load_audio_dependencies() -> None:
+    """Import the decoding and resampling libraries up front.
+
+    The macOS client records at the device's native rate, so nearly every
+    upload is resampled; importing here keeps that cost out of the first
+    request and surfaces a missing package at startup.
+    """
+    try:
+        import numpy  # noqa: F401
+        import soundfile  # type: ignore  # noqa: F401
+        import soxr  # type: ignore  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy, soundfile and soxr are required to decode audio. "
+            "Install with: pip install numpy soundfile soxr"
+        ) from exc
+
+
+def transcribe_audio(model: Any, audio: Any) -> str:
+    """Run the loaded Whisper backend on 16 kHz mono float32 PCM."""
+    if WHISPER_BACKEND == "faster":
+        segments, _info = model.transcribe(audio, vad_filter=True, beam_size=1)
+        # ``segments`` is a lazy generator; decoding happens while iterating.
+        return "".join(segment.text for segment in segments).strip()
+    if WHISPER_BACKEND == "onnxruntime":
+        return _transcribe_onnx(model, audio)
+
+    use_fp16 = model.device.type == "cuda"
+    result = model.transcribe(audio, fp16=use_fp16)
+    return (result.get("text") or "").strip()
+
+
+def get_compressor() -> Any:
+    """Load LLMLingua once per process and reuse across requests."""
+    global _compressor
+    if _compressor is not None:
+        return _compressor
+
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = _load_compressor()
+    return _compressor
+
+
+def _load_compressor() -> Any:
+    try:
+        from llmlingua import PromptCompressor
+    except ImportError as exc:
+        raise RuntimeError(
+            "llmlingua is not installed. "
+            "Install with: pip install llmlingua accelerate"
+        ) from exc
+
+    init_kwargs: dict[str, Any] = {"model_name": LLMLINGUA_MODEL}
+
+    device_map = LLMLINGUA_DEVICE
+    if device_map == "auto":
+        try:
+            import torch
+
+            if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+                device_map = "mps"
+            elif torch.cuda.is_available():
+                device_map = "cuda"
+            else:
+                device_map = "cpu"
+        except Exception:
+            device_map = "cpu"
+    init_kwargs["device_map"] = device_map
+
+    if LLMLINGUA_USE_V2:
+        init_kwargs["use_llmlingua2"] = True
+
+    if LLMLINGUA_QUANTIZE and device_map in {"cuda", "mps"}:
+        import torch
+
+        init_kwargs["model_config"] = {"torch_dtype": torch.float16}
+
+    compressor = PromptCompressor(**init_kwargs)
+
+    if LLMLINGUA_QUANTIZE and device_map == "cpu":
+        _quantize_compressor_int8(compressor)
+    return compressor
+
+
+def _quantize_compressor_int8(compressor: Any) -> None:
+    """Swap the compressor's Linear layers for dynamic INT8 versions on CPU."""
+    try:
+        import torch
+
+        compressor.model = torch.ao.quantization.quantize_dynamic(
+            compressor.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    except Exception as exc:
+        # e.g. no quantized engine available for this CPU; keep the FP32 model.
+        logger.warning("llmlingua_int8_skipped: %s", exc)
+
+
+def extract_compressed_text(compression_result: Any, original_text: str = "") -> str:
+    """Normalize LLMLingua output across versions."""
+    if isinstance(compression_result, str):
+        return compression_result.strip()
+
+    if isinstance(compression_result, dict):
+        for key in ("compressed_prompt", "compressed_text", "prompt", "text"):
+            value = compression_result.get(key)
+            if isinstance(value, str):
+                return value.strip()
+
+    if original_text:
+        return original_text
+    raise RuntimeError("LLMLingua returned an unexpected compression result")
+
+
+def _too_short_to_compress(clean_text: str) -> bool:
+    """Return True when compressing would cost more than it saves."""
+    if len(clean_text) < LLMLINGUA_MIN_CHARS:
+        return True
+    if LLMLINGUA_MIN_TOKENS > 0:
+        tokenizer = getattr(get_compressor(), "tokenizer", None)
+        if tokenizer is not None:
+            n_tokens = len(tokenizer.encode(clean_text, add_special_tokens=False))
+            return n_tokens < LLMLINGUA_MIN_TOKENS
+    return False
+
+
+def compress_transcript(text: str) -> str:
+    clean_text = text.strip()
+    if not clean_text or _too_short_to_compress(clean_text):
+        return clean_text
+
+    compressor = get_compressor()
+
+    context = [clean_text]
+
+    try:
+        if LLMLINGUA_USE_V2 and hasattr(compressor, "compress_prompt_llmlingua2"):
+            result = compressor.compress_prompt_llmlingua2(context, rate=LLMLINGUA_RATE)
+        else:
+            result = compressor.compress_prompt(context, rate=LLMLINGUA_RATE)
+    except TypeError:
+        result = compressor.compress_prompt(context, rate=LLMLINGUA_RATE)
+
+    return extract_compressed_text(result, original_text=clean_text)
+
+
+def compress_transcripts(texts: list[str]) -> list[str | Exception]:
+    """Compress several transcripts with one LLMLingua-2 call.
+
+    Each transcript is compressed independently at ``LLMLINGUA_RATE``; the
+    batch only shares the forward pass. If the batched call fails or the
+    installed LLMLingua does not return per-context results, each transcript
+    is compressed on its own. A transcript that still fails gets its
+    exception in place of a result, so it does not fail the rest of the batch.
+    """
+    if len(texts) == 1:
+        return [compress_transcript(texts[0])]
+
+    results: list[str | Exception] = [text.strip() for text in texts]
+    pending = [
+        i for i, text in enumerate(results) if text and not _too_short_to_compress(text)
+    ]
+    if not pending:
+        return results
+
+    compressor = get_compressor()
+
+    if LLMLINGUA_USE_V2 and hasattr(compressor, "compress_prompt_llmlingua2"):
+        try:
+            result = compressor.compress_prompt_llmlingua2(
+                [texts[i].strip() for i in pending], rate=LLMLINGUA_RATE
+            )
+        except Exception:
+            result = None
+        compressed = result.get("compressed_prompt_list") if isinstance(result, dict) else None
+        if isinstance(compressed, list) and len(compressed) == len(pending):
+            for i, text in zip(pending, compressed):
+                results[i] = text.strip()
+            return results
+
+    for i in pending:
+        try:
+            results[i] = compress_transcript(texts[i])
+        except Exception as exc:
+            results[i] = exc
+    return results
+
+
+async def _compress_batcher() -> None:
+    """Drain queued transcripts into micro-batches for ``compress_transcripts``.
+
+    A batch is whatever is queued when the previous one finishes (up to
+    ``LLMLINGUA_BATCH_MAX``), optionally topped up for ``LLMLINGUA_BATCH_WAIT_MS``,
+    so a lone request is never held back by default.
+    """
+    assert _compress_queue is not None
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = [await _compress_queue.get()]
+
+        if LLMLINGUA_BATCH_WAIT_MS > 0:
+            deadline = loop.time() + LLMLINGUA_BATCH_WAIT_MS / 1000
+            while len(batch) < LLMLINGUA_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_compress_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+        while len(batch) < LLMLINGUA_BATCH_MAX and not _compress_queue.empty():
+            batch.append(_compress_queue.get_nowait())
+
+        try:
+            compressed = await loop.run_in_executor(
+                _infer_pool, compress_transcripts, [text for text, _ in batch]
+            )
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            continue
+
+        for (_, future), outcome in zip(batch, compressed):
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+async def compress_transcript_batched(text: str) -> str:
+    """Queue a transcript for the LLMLingua batcher and wait for its result."""
+    clean_text = text.strip()
+    if len(clean_text) < LLMLINGUA_MIN_CHARS:
+        return clean_text
+
+    assert _compress_queue is not None
+    future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+    await _compress_queue.put((text, future))
+    return await future
+
+
+def _audio_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Audio too large. Max allowed is {MAX_AUDIO_BYTES} bytes",
+    )
+
+
+async def read_upload(audio: UploadFile) -> io.BytesIO:
+    """Read an upload in fixed-size chunks, rejecting it once it exceeds the limit.
+
+    Returns a ``BytesIO`` rewound to the start so decoders can read it in
+    place instead of copying the payload.
+    """
+    buffer = io.BytesIO()
+    while chunk := await audio.read(UPLOAD_CHUNK_BYTES):
+        if buffer.tell() + len(chunk) > MAX_AUDIO_BYTES:
+            raise _audio_too_large()
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+async def read_body(request: Request) -> bytearray:
+    """Read a raw request body as it streams in, rejecting it once it exceeds the limit."""
+    buffer = bytearray()
+    async for chunk in request.stream():
+        if len(buffer) + len(chunk) > MAX_AUDIO_BYTES:
+            raise _audio_too_large()
+        buffer += chunk
+    return buffer
+
+
+def _transcribe_upload(audio: io.BytesIO, suffix: str) -> str:
+    pcm = decode_audio(audio, suffix)
+    return transcribe_audio(get_model(), pcm)
+
+
+def _transcribe_raw(raw_audio: bytes, sample_rate: int, sample_format: str) -> str:
+    pcm = decode_raw_pcm(raw_audio, sample_rate, sample_format)
+    return transcribe_audio(get_model(), pcm)
+
+
+class ContentLengthLimit:
+    """ASGI middleware that returns 413 from ``Content-Length`` before the body is read.
+
+    FastAPI parses multipart bodies before the handler runs, so this has to
+    happen ahead of routing; ``read_upload``/``read_body`` still enforce the
+    limit for chunked uploads that omit the header.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name != b"content-length":
+                    continue
+                if value.isdigit() and int(value) > MAX_AUDIO_BYTES + MULTIPART_OVERHEAD_BYTES:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"detail": f"Audio too large. Max allowed is {MAX_AUDIO_BYTES} bytes"},
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        await self.app(scope, receive, send)
+
+
+def _orjson_response_class() -> type[Response] | None:
+    """Return ``ORJSONResponse`` when it is the faster choice, else ``None``.
+
+    Newer FastAPI releases serialize typed return values straight to JSON
+    bytes via Pydantic and deprecate ``ORJSONResponse``; overriding the
+    response class there would bypass that path, so keep FastAPI's default.
+    """
+    try:
+        import orjson  # noqa: F401
+        from fastapi.responses import ORJSONResponse
+    except ImportError:
+        return None
+    if getattr(ORJSONResponse, "__deprecated__", None):
+        return None
+    return ORJSONResponse
+
+
+def app_factory(
+    enable_compression: bool = True,
+    title: str = "WisprClaw Whisper Gateway",
+) -> FastAPI:
+    """Build a gateway app; models, pools and the batcher are shared per process.
+
+    With ``enable_compression=False`` LLMLingua is never loaded and
+    ``/transcribe`` always returns the raw Whisper transcript.
+    """
+    app_kwargs: dict[str, Any] = {"title": title}
+    response_class = _orjson_response_class()
+    if response_class is not None:
+        app_kwargs["default_response_class"] = response_class
+    app = FastAPI(**app_kwargs)
+    compress_by_default = enable_compression and LLMLINGUA_ENABLED
+
+    app.add_middleware(ContentLengthLimit)
+
+    @app.on_event("startup")
+    async def _preload() -> None:
+        """Load models before serving so the first request does not pay for it.
+
+        Missing audio libraries abort startup. Model load failures are logged
+        rather than raised; ``/ready`` keeps returning 503 and ``/transcribe``
+        retries the load and reports the error per request.
+        """
+        global _infer_pool, _compress_queue, _compress_task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, load_audio_dependencies)
+
+        loaders = [get_model]
+        if compress_by_default:
+            loaders.append(get_compressor)
+
+        for loader in loaders:
+            try:
+                await loop.run_in_executor(None, loader)
+            except Exception as exc:
+                logger.error("preload_failed: %s: %s", loader.__name__, exc)
+
+        if _infer_pool is None:
+            workers = WHISPER_WORKERS
+            # A GPU runs one inference at a time; extra workers only contend for it.
+            if "cuda" in _model_device.lower():
+                workers = 1
+            _infer_pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="inference"
+            )
+
+        if enable_compression and _compress_task is None:
+            _compress_queue = asyncio.Queue()
+            _compress_task = asyncio.create_task(_compress_batcher())
+
+    @app.on_event("shutdown")
+    def _shutdown_pool() -> None:
+        global _infer_pool, _compress_queue, _compress_task
+        if _compress_task is not None:
+            _compress_task.cancel()
+            _compress_task = None
+            _compress_queue = None
+        if _infer_pool is not None:
+            _infer_pool.shutdown(wait=False, cancel_futures=True)
+            _infer_pool = None
+
+    @app.get("/health")
+    def health() -> dict[str, str]:
+        return {"status": "ok", "model": MODEL_NAME}
+
+    @app.get("/ready")
+    def ready(response: Response) -> dict[str, str]:
+        """Report whether models are loaded; 503 until startup preload finishes."""
+        is_ready = _model is not None and (_compressor is not None or not compress_by_default)
+        if not is_ready:
+            response.status_code = 503
+            return {"status": "loading", "model": MODEL_NAME}
+        return {"status": "ready", "model": MODEL_NAME}
+
+    @app.post("/transcribe")
+    async def transcribe(
+        audio: UploadFile = File(...),
+        compress: str | None = None,
+    ) -> dict[str, str]:
+        """Accept multipart audio file and return transcribed text.
+
+        The optional ``compress`` query parameter overrides the server-wide
+        ``LLMLINGUA_ENABLED`` setting for this single request.  Accepted values
+        are ``1``/``true``/``yes``/``on`` to enable and ``0``/``false``/``no``/``off``
+        to disable.
+        """
+        should_compress = _should_compress(compress)
+        suffix = Path(audio.filename or "recording.wav").suffix or ".wav"
+
+        try:
+            async with _inflight:
+                raw_audio = await read_upload(audio)
+                if not raw_audio.getbuffer().nbytes:
+                    raise HTTPException(status_code=400, detail="Empty audio upload")
+
+                # Decoding, inference and compression are blocking; keep them off the event loop.
+                loop = asyncio.get_running_loop()
+                original_text = await loop.run_in_executor(
+                    _infer_pool, _transcribe_upload, raw_audio, suffix
+                )
+                del raw_audio
+            return await _finish(original_text, should_compress)
+        except HTTPException:
+            raise
+        except RuntimeError as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"Transcription failed: {exc}") from exc
+        finally:
+            await audio.close()
+
+    @app.post("/transcribe_raw")
+    async def transcribe_raw(
+        request: Request,
+        compress: str | None = None,
+    ) -> dict[str, str]:
+        """Accept raw mono PCM in the request body and return transcribed text.
+
+        For clients that already hold decoded audio; no container decoding or
+        ffmpeg is involved. ``X-Sample-Format`` is ``f32le`` (default) or
+        ``s16le`` (half the bytes), and ``X-Sample-Rate`` defaults to 16000;
+        other rates are resampled. ``compress`` behaves as for ``/transcribe``.
+        """
+        sample_format = request.headers.get("x-sample-format", "f32le").strip().lower()
+        if sample_format not in RAW_SAMPLE_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported X-Sample-Format. Use one of: {', '.join(RAW_SAMPLE_FORMATS)}",
+            )
+        try:
+            sample_rate = int(request.headers.get("x-sample-rate", SAMPLE_RATE))
+        except ValueError:
+            sample_rate = 0
+        if sample_rate <= 0:
+            raise HTTPException(status_code=400, detail="Invalid X-Sample-Rate")
+
+        should_compress = _should_compress(compress)
+        sample_width = 4 if sample_format == "f32le" else 2
+
+        try:
+            async with _inflight:
+                raw_audio = await read_body(request)
+                if not raw_audio:
+                    raise HTTPException(status_code=400, detail="Empty audio upload")
+                if len(raw_audio) % sample_width:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Body length is not a multiple of the {sample_format} sample size",
+                    )
+
+                loop = asyncio.get_running_loop()
+                original_text = await loop.run_in_executor(
+                    _infer_pool, _transcribe_raw, raw_audio, sample_rate, sample_format
+                )
+                del raw_audio
+            return await _finish(original_text, should_compress)
+        except HTTPException:
+            raise
+        except RuntimeError as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"Transcription failed: {exc}") from exc
+
+    def _should_compress(compress: str | None) -> bool:
+        # Per-request param overrides the global default.
+        if not enable_compression:
+            return False
+        if compress is not None:
+            return _is_truthy(compress)
+        return compress_by_default
+
+    async def _finish(original_text: str, should_compress: bool) -> dict[str, str]:
+        compressed_text = (
+            await compress_transcript_batched(original_text)
+            if should_compress
+            else original_text
+        )
+        logger.info("transcript_original: %s", original_text)
+        logger.info("transcript_compressed: %s", compressed_text)
+        return {"text": compressed_text}
+
+    return app
+
+
+def serve(app_path: str, default_port: int) -> None:
+    """Run ``app_path`` (a ``module:attribute`` string) under uvicorn.
+
+    ``GATEWAY_HOST``, ``GATEWAY_PORT`` and ``GATEWAY_WORKERS`` override the
+    defaults. The app is passed by import path so worker processes can load it.
+    """
+    host = os.getenv("GATEWAY_HOST", "127.0.0.1")
+    port = int(os.getenv("GATEWAY_PORT", str(default_port)))
+    workers = max(1, int(os.getenv("GATEWAY_WORKERS", "1")))
+
+    # Every worker process loads its own model copy; on one GPU they would
+    # only contend for the same device.
+    if workers > 1:
+        device = _faster_whisper_device() if WHISPER_BACKEND == "faster" else _torch_whisper_device()
+        if device == "cuda":
+            raise RuntimeError(
+                "GATEWAY_WORKERS > 1 is only supported for CPU inference. "
+                "Use GATEWAY_WORKERS=1 with CUDA."
+            )
+
+    uvicorn.run(
+        app_path,
+        app_dir=str(Path(__file__).resolve().parent),
+        host=host,
+        port=port,
+        workers=workers,
+        log_level="info",
+    )